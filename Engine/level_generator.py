@@ -0,0 +1,371 @@
+import argparse
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from object import Object
+
+# Player physics constants, mirrored from ComponentPlayerInputJump in source/script.d
+JUMP_STRENGTH = 13.0
+MAX_VELOCITY = 10.0
+SMALL_GRAVITY = 0.9
+GROUND_LEVEL = 480
+
+GRID_SIZE_Y = 10
+RUNWAY = 6 # Empty columns before the first section
+FINISH_RUNOFF = 4 # Empty columns between the last section and the flag
+
+DEFAULT_CONFIG = {
+    "audio": "assets/sound/default_level.wav",
+    "gravity": 0.7,
+    "cell_size": 48,
+    "player_speed": 4,
+    "sprite_map": {
+        "Player": "assets/images/player.json",
+        "Square": "assets/images/square.json",
+        "Triangle": "assets/images/triangle.json",
+        "Finish": "assets/images/flag.json",
+        "Bouncer": "assets/images/bouncer.json",
+        "GravityFlipper": "assets/images/gravityflipper.json",
+        "SizeFlipper": "assets/images/sizeflipper.json"
+    }
+}
+
+SLACK = 0.5 # Columns added to every run-up, so no rest depends on frame-perfect input
+MAX_NEED = 0.95 # Largest share of an arc's height or reach a motif may ask for
+
+class JumpProfile:
+    # Heights (in pixels above the take-off point) of the player's airborne arcs, stepped with the same integer
+    # update as the engine, and the distances (in columns) the generator works out from them. Distances follow
+    # the player's left edge, which touches column c once it is past c - 1.
+    def __init__(self, config, bounce_height):
+        if config["gravity"] <= 0:
+            raise ValueError(f"gravity must be positive, got {config['gravity']}")
+        if config["player_speed"] <= 0:
+            raise ValueError(f"player speed must be positive, got {config['player_speed']}")
+        self.cell_size = config["cell_size"]
+        self.step = config["player_speed"] / self.cell_size # Columns travelled per frame
+        self.gravity = config["gravity"]
+        self.arcs = {
+            "jump": self.arc(JUMP_STRENGTH, self.gravity),
+            "bounce": self.arc(bounce_height, self.gravity),
+            "small": self.arc(JUMP_STRENGTH, SMALL_GRAVITY)
+        }
+        self.flip_transit = self.fall_frames(GROUND_LEVEL - self.cell_size, self.gravity) * self.step
+        # Shrinking lifts the player's feet one cell off the ground
+        self.shrink_settle = self.fall_frames(self.cell_size, SMALL_GRAVITY) * self.step
+        if self.height("jump") < 1:
+            raise ValueError(f"gravity {self.gravity} is too strong for the jump to clear one cell")
+        # The frame after landing on a Square moves the player int(gravity) pixels into it, which the engine
+        # treats as a collision, so from gravity 1 up it can only hop straight off again
+        self.can_stand = int(self.gravity) == 0
+
+    @staticmethod
+    def arc(strength, gravity):
+        # Height above the take-off point on every frame until the player is back down
+        velocity, y, heights = -strength, 0, []
+        while True:
+            velocity = min(velocity + gravity, MAX_VELOCITY)
+            y += int(velocity)
+            if y >= 0:
+                return heights
+            heights.append(-y)
+
+    @staticmethod
+    def fall_frames(distance, gravity):
+        velocity, y, frames = 0.0, 0, 0
+        while y < distance:
+            velocity = min(velocity + gravity, MAX_VELOCITY)
+            y += int(velocity)
+            frames += 1
+        return frames
+
+    def height(self, arc):
+        # Peak of the arc in rows
+        return max(self.arcs[arc], default=0) / self.cell_size
+
+    def reach(self, arc, rows=1):
+        # Columns spent at least rows above the take-off point
+        return sum(height >= rows * self.cell_size for height in self.arcs[arc]) * self.step
+
+    def rise(self, arc, rows):
+        # Columns from take-off until the player is rows above the take-off point
+        for frame, height in enumerate(self.arcs[arc]):
+            if height >= rows * self.cell_size:
+                return (frame + 1) * self.step
+        return math.inf
+
+    def clear(self, arc, rows):
+        # Columns from take-off until the player sinks below rows above the take-off point
+        frames = [frame for frame, height in enumerate(self.arcs[arc]) if height >= rows * self.cell_size]
+        return (frames[-1] + 1) * self.step if frames else 0.0
+
+    def flight(self, arc):
+        return (len(self.arcs[arc]) + 1) * self.step
+
+    def drop(self, rows):
+        # Columns travelled while falling rows after running off a platform
+        return self.fall_frames(rows * self.cell_size, self.gravity) * self.step
+
+    def run_up(self, rows, arc="jump"):
+        # Columns needed between touching down and an obstacle rows high: one frame on the ground, the rise,
+        # and the player's own width. Rows 0 means the obstacle has to be reached on the ground.
+        if rows == 0:
+            return 1 + SLACK
+        return 1 + self.step + self.rise(arc, rows) + SLACK
+
+    def runoff(self, count, arc="jump"):
+        # Columns past a run of count spikes until the player is down again, having taken off as late as possible
+        return max(0.0, self.flight(arc) - self.rise(arc, 1) - 1 - count)
+
+    def need(self, kind, value):
+        # Share of an arc a requirement uses. A spike's tall middle needs a full cell of clearance and its flat base
+        # an eighth of one; the bouncer launches the player a column before its spikes.
+        if kind == "climb":
+            return self.share(value + 0.25, self.height("jump"))
+        if kind == "bounce":
+            return max(self.share(value + 1.5625, self.clear(kind, 1)), self.share(value + 1.9375, self.clear(kind, 0.125)))
+        width = 0.5 if kind == "small" else 1
+        return max(self.share(value + width - 0.875, self.reach(kind, 1)),
+                   self.share(value + width - 0.125, self.reach(kind, 0.125)))
+
+    @staticmethod
+    def share(needed, available):
+        # An arc that never gets high enough cannot meet any requirement
+        return needed / available if available > 0 else math.inf
+
+class Motif:
+    # A pattern entered and left with the player in normal state.
+    # cells are (dx, row, obj_name, angle) with row 0 as the ground row.
+    def __init__(self, kind, width, cells, requirements, entry=0, runoff=0.0):
+        self.kind = kind
+        self.width = width
+        self.cells = cells
+        self.requirements = requirements # (arc, count) pairs for spikes to clear in one arc, or ("climb", rows)
+        self.entry = entry # Rows the player must be above the ground at the first column, 0 to reach it grounded
+        self.runoff = runoff # Columns past the end until the player is back on the ground
+
+def spikes_motif(rng, difficulty, profile):
+    count = rng.randint(1, 2 + int(2 * difficulty))
+    cells = [(dx, 0, "Triangle", 0) for dx in range(count)]
+    return Motif("spikes", count, cells, [("jump", count)], entry=1, runoff=profile.runoff(count))
+
+def block_motif(rng, difficulty, profile):
+    height = rng.randint(1, 2 + int(difficulty + 0.5))
+    length = rng.randint(2, 9)
+    cells = [(dx, row, "Square", 0) for dx in range(length) for row in range(height)]
+    requirements = [("climb", height)]
+    runoff = profile.drop(height)
+    if profile.need("climb", height) > MAX_NEED:
+        return Motif("block", length, cells, requirements, entry=height, runoff=runoff)
+
+    # Taking off as late as possible to clear the face lands here on top, or carries the player past the platform
+    take_off = -1 - profile.rise("jump", height)
+    landing = take_off + profile.clear("jump", height) + profile.step
+    if landing >= length:
+        runoff = max(runoff, take_off + profile.flight("jump") - length)
+    elif not profile.can_stand:
+        # Hopping along the top, the last hop takes off before the end and comes down past it
+        runoff = max(runoff, profile.flight("jump") + profile.drop(height))
+        return Motif("block", length, cells, requirements, entry=height, runoff=runoff)
+
+    # Spikes on top of the platform at higher difficulty
+    start = math.ceil(landing + profile.run_up(1))
+    if start + 2 <= length and rng.random() < difficulty:
+        count = rng.randint(1, min(length - start - 1, 1 + int(2 * difficulty)))
+        cells += [(start + i, height, "Triangle", 0) for i in range(count)]
+        requirements.append(("jump", count))
+        # Jumping the last spike may carry the player off the end before it drops to the ground
+        overrun = start + count + profile.runoff(count) - length
+        runoff = max(runoff, max(0.0, overrun) + profile.drop(height))
+    return Motif("block", length, cells, requirements, entry=height, runoff=runoff)
+
+def bounce_motif(rng, difficulty, profile):
+    count = rng.randint(2, 3 + int(3 * difficulty))
+    cells = [(0, 0, "Bouncer", 0)] + [(1 + i, 0, "Triangle", 0) for i in range(count)]
+    # The bouncer fires as the player touches it, a column before the spikes
+    runoff = max(0.0, profile.flight("bounce") - 2 - count)
+    return Motif("bounce", count + 1, cells, [("bounce", count)], runoff=runoff)
+
+def flip_motif(rng, difficulty, profile):
+    # Flip onto the ceiling, dodge hanging spikes, flip back down
+    top = GRID_SIZE_Y - 1
+    cells = [(0, 0, "GravityFlipper", 0)]
+    requirements = []
+    landed = profile.flip_transit - 1
+    for _ in range(rng.randint(1, 1 + int(3 * difficulty))):
+        count = rng.randint(1, 1 + int(2 * difficulty))
+        dx = math.ceil(landed + profile.run_up(1)) + rng.randint(0, 2)
+        cells += [(dx + i, top, "Triangle", 2) for i in range(count)]
+        requirements.append(("jump", count))
+        landed = dx + count + profile.runoff(count)
+    dx = math.ceil(landed + profile.run_up(0)) + rng.randint(0, 2)
+    cells.append((dx, top, "GravityFlipper", 0))
+    return Motif("flip", dx + 1, cells, requirements, runoff=max(0.0, profile.flip_transit - 2))
+
+def shrink_motif(rng, difficulty, profile):
+    # Shrink, hop a few spikes with the small jump, grow back
+    cells = [(0, 0, "SizeFlipper", 0)]
+    requirements = []
+    landed = profile.shrink_settle - 1
+    for _ in range(rng.randint(1, 1 + int(2 * difficulty))):
+        count = rng.randint(1, 1 + int(2 * difficulty))
+        dx = math.ceil(landed + profile.run_up(1, "small")) + rng.randint(0, 2)
+        cells += [(dx + i, 0, "Triangle", 0) for i in range(count)]
+        requirements.append(("small", count))
+        landed = dx + count + profile.runoff(count, "small")
+    dx = math.ceil(landed + profile.run_up(0)) + rng.randint(0, 2)
+    cells.append((dx, 0, "SizeFlipper", 0))
+    return Motif("shrink", dx + 1, cells, requirements)
+
+MOTIFS = [
+    # (generator, weight at difficulty 0, weight at difficulty 1)
+    (spikes_motif, 4, 3),
+    (block_motif, 3, 3),
+    (bounce_motif, 1, 2),
+    (flip_motif, 0.5, 2),
+    (shrink_motif, 0.5, 2)
+]
+
+def generate_section(seed, width, difficulty, profile):
+    # Fill a section with motifs, each after the rest it needs plus a random margin; returns [(start, motif)].
+    # The player enters and leaves the section on the ground.
+    rng = random.Random(seed)
+    weights = [low + (high - low) * difficulty for _, low, high in MOTIFS]
+    max_margin = max(1, 3 - int(3 * difficulty))
+
+    section = []
+    end, runoff = 0, 0.0
+    for _ in range(width):
+        make_motif = rng.choices(MOTIFS, weights=weights)[0][0]
+        motif = make_motif(rng, difficulty, profile)
+        rest = runoff + profile.run_up(motif.entry)
+        if math.isinf(rest):
+            continue # Taller than this physics can climb
+        start = end + math.ceil(rest) + rng.randint(0, max_margin)
+        if start + motif.width + motif.runoff > width:
+            break
+        section.append((start, motif))
+        end, runoff = start + motif.width, motif.runoff
+    return section
+
+def score_section(section, width, difficulty, profile):
+    # Reject sections with a motif the arcs cannot clear, then prefer the closest match to the target difficulty.
+    # Rests are not checked here: generate_section already leaves each motif the rest it needs, so spacing only
+    # counts through the density.
+    tightness = []
+    for _, motif in section:
+        for kind, value in motif.requirements:
+            need = profile.need(kind, value)
+            if need > MAX_NEED:
+                return None
+            tightness.append(need)
+
+    if not section:
+        return -difficulty
+    density = min(1.0, 4 * len(section) / width)
+    estimate = 0.5 * sum(tightness) / max(1, len(tightness)) + 0.5 * density
+    variety = len({motif.kind for _, motif in section})
+    return -abs(estimate - difficulty) + 0.02 * variety
+
+def evaluate_candidate(task):
+    seed, width, difficulty, profile = task
+    return score_section(generate_section(seed, width, difficulty, profile), width, difficulty, profile)
+
+class LevelGenerator:
+    def __init__(self, seed=0, difficulty=0.3, ramp=0.0, section_width=25, candidates=32,
+                 gravity=None, player_speed=None, bounce_height=18.5, workers=None):
+        self.seed = seed
+        self.difficulty = difficulty
+        self.ramp = ramp
+        self.section_width = section_width
+        self.candidates = candidates
+        self.bounce_height = bounce_height
+        self.workers = workers
+
+        self.config = dict(DEFAULT_CONFIG)
+        if gravity is not None:
+            self.config["gravity"] = gravity
+        if player_speed is not None:
+            self.config["player_speed"] = player_speed
+        self.profile = JumpProfile(self.config, bounce_height)
+
+    def section_difficulty(self, index, num_sections):
+        return min(1.0, max(0.0, self.difficulty + self.ramp * index / max(1, num_sections - 1)))
+
+    def generate(self, level_width):
+        num_sections = max(1, (level_width - RUNWAY - FINISH_RUNOFF - 1) // self.section_width)
+
+        # Draw every candidate seed up front so results do not depend on worker scheduling
+        rng = random.Random(self.seed)
+        tasks = []
+        for index in range(num_sections):
+            difficulty = self.section_difficulty(index, num_sections)
+            for _ in range(self.candidates):
+                tasks.append((rng.getrandbits(64), self.section_width, difficulty, self.profile))
+
+        if self.workers == 1:
+            scores = list(map(evaluate_candidate, tasks))
+        else:
+            workers = self.workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunksize = max(1, len(tasks) // (4 * workers))
+                scores = list(executor.map(evaluate_candidate, tasks, chunksize=chunksize))
+
+        # Stitch the best candidate of every section, leaving the section empty if none is playable
+        objects = []
+        for index in range(num_sections):
+            best_score, best_task = None, None
+            for i in range(index * self.candidates, (index + 1) * self.candidates):
+                if scores[i] is not None and (best_score is None or scores[i] > best_score):
+                    best_score, best_task = scores[i], tasks[i]
+            if best_task is None:
+                continue
+
+            seed, width, difficulty, _ = best_task
+            offset = RUNWAY + index * self.section_width
+            for start, motif in generate_section(seed, width, difficulty, self.profile):
+                for dx, row, obj_name, angle in motif.cells:
+                    obj = Object(offset + start + dx, GRID_SIZE_Y - 1 - row, obj_name, angle * 90)
+                    if obj_name == "Bouncer":
+                        obj.properties["bounce_height"] = self.bounce_height
+                    objects.append(obj)
+
+        finish_x = RUNWAY + num_sections * self.section_width + FINISH_RUNOFF
+        objects.append(Object(finish_x, GRID_SIZE_Y - 1, "Finish", 0))
+
+        payload = {}
+        payload["config"] = dict(self.config)
+        payload["config"]["level_width"] = max(level_width, finish_x + 2)
+        payload["objects"] = [obj.serialized() for obj in objects]
+        return payload
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a draft level that the editor can load.")
+    parser.add_argument("--width", type=int, default=200, help="level width in columns")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--difficulty", type=float, default=0.3, help="target difficulty from 0 to 1")
+    parser.add_argument("--ramp", type=float, default=0.0, help="difficulty added by the end of the level")
+    parser.add_argument("--section-width", type=int, default=25)
+    parser.add_argument("--candidates", type=int, default=32, help="candidates scored per section")
+    parser.add_argument("--gravity", type=float, default=None)
+    parser.add_argument("--player-speed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (1 runs in-process)")
+    parser.add_argument("--output", default="assets/levels/generated_level.json")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        generator = LevelGenerator(seed=args.seed, difficulty=args.difficulty, ramp=args.ramp,
+                                   section_width=args.section_width, candidates=args.candidates,
+                                   gravity=args.gravity, player_speed=args.player_speed, workers=args.workers)
+    except ValueError as error:
+        parser.error(str(error))
+    payload = generator.generate(args.width)
+
+    with open(args.output, "w") as file:
+        json.dump(payload, file, indent=4)
+    print(f"Wrote {len(payload['objects'])} objects over {payload['config']['level_width']} columns "
+          f"to {args.output} in {time.perf_counter() - start:.2f}s")
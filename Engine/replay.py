@@ -0,0 +1,549 @@
+import argparse
+import json
+import math
+import time
+import numpy as np
+from PIL import Image
+
+# Engine constants, mirrored from source/script.d and source/gameapplication.d
+JUMP_STRENGTH = 13.0
+MAX_VELOCITY = 10.0
+SMALL_GRAVITY = 0.9
+ROTATION_SPEED = 5.0
+WINDOW_WIDTH = 640
+WINDOW_HEIGHT = 480
+PLAYER_START_X = 180
+BACKGROUND = (200, 200, 200)
+ANIMATION_FRAMES = 9 # 150ms per animation frame at 60fps
+STATIC_SIZES = {"Static1": (200, 200), "Static2": (500, 300)}
+PARALLAX_SPEEDS = {"Static1": 1, "Static2": 2}
+MAX_ANIMATION_FRAMES = 600 # Frames in an animated preview when no step is given
+PALETTE_SAMPLES = 16 # Frames rendered to build the animation palette
+
+# Per-frame state flags
+GROUNDED = 1
+FLIPPED = 2
+SMALL = 4
+ALIVE = 8
+
+# Per-frame events
+JUMP = 1
+LAND = 2
+BOUNCE = 4
+GRAVITY_FLIP = 8
+SIZE_FLIP = 16
+DEATH = 32
+FINISH = 64
+EVENT_NAMES = {JUMP: "jump", LAND: "land", BOUNCE: "bounce", GRAVITY_FLIP: "gravity_flip",
+               SIZE_FLIP: "size_flip", DEATH: "death", FINISH: "finish"}
+
+def intersect(a, b):
+    # SDL_IntersectRect on (x, y, w, h) tuples; touching edges do not count
+    w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if w > 0 and h > 0:
+        return w, h
+    return None
+
+def rotate_rect(rect, angle, box):
+    # Same as ComponentCollision.rotateRect
+    x, y, w, h = rect
+    bx, by, bw, bh = box
+    if angle == 90:
+        return (bx + bh - (y - by + h), by + (x - bx), h, w)
+    if angle == 180:
+        return (bx + bw - (x - bx + w), by + bh - (y - by + h), w, h)
+    if angle == 270:
+        return (bx + (y - by), by + bw - (x - bx + w), h, w)
+    return rect
+
+def round_half_away(value):
+    # D's round() rounds halves away from zero, unlike Python's round()
+    return math.copysign(math.floor(abs(value) + 0.5), value)
+
+class LevelObject:
+    def __init__(self, index, obj_name, x, y, w, h, angle, bounce_height):
+        self.index = index
+        self.obj_name = obj_name
+        self.rect = (x, y, w, h)
+        self.angle = angle
+        self.bounce_height = bounce_height
+        self.hitboxes = self.make_hitboxes()
+
+    def make_hitboxes(self):
+        x, y, w, h = self.rect
+        if self.obj_name == "Triangle":
+            lower = (x + w // 16, y + h * 7 // 8, w * 7 // 8, h // 8)
+            upper = (x + w * 7 // 16, y, w // 8, h * 7 // 8)
+            return [rotate_rect(lower, self.angle, self.rect), rotate_rect(upper, self.angle, self.rect)]
+        if self.obj_name == "Bouncer":
+            return [rotate_rect((x, y + h * 3 // 4, w, h // 4), self.angle, self.rect)]
+        return [self.rect]
+
+class ReplayLevel:
+    def __init__(self, level_file_path):
+        with open(level_file_path, "r") as file:
+            level_data = json.load(file)
+
+        self.config = level_data["config"]
+        self.cell_size = self.config["cell_size"]
+        self.gravity = self.config["gravity"]
+        self.player_speed = self.config["player_speed"]
+
+        # Split objects the same way GameApplication.CreateLevelScene builds the scene tree
+        self.collidables = []
+        self.statics = []
+        self.finish = None
+        for index, obj in enumerate(level_data["objects"]):
+            obj_name = obj["obj_name"]
+            x = obj["x"] * self.cell_size
+            y = WINDOW_HEIGHT - (obj["y"] + 1) * self.cell_size
+            w, h = STATIC_SIZES.get(obj_name, (self.cell_size, self.cell_size))
+            level_obj = LevelObject(index, obj_name, x, y, w, h,
+                                    obj["angle"] % 4 * 90, obj.get("bounce_height", 0.0))
+            if obj_name == "Finish":
+                self.finish = level_obj
+            elif obj_name in STATIC_SIZES:
+                self.statics.append(level_obj)
+            else:
+                self.collidables.append(level_obj)
+
+        # Bucket collidables by column so each frame only looks at the player's neighbourhood
+        self.columns = {}
+        for obj in self.collidables:
+            self.columns.setdefault(obj.rect[0] // self.cell_size, []).append(obj)
+
+    def nearby(self, rect):
+        return self.in_columns(rect[0] // self.cell_size - 1, (rect[0] + rect[2]) // self.cell_size + 1)
+
+    def in_columns(self, first, last):
+        # Collidables between two columns, in scene tree order
+        found = []
+        for column in range(first, last + 1):
+            found.extend(self.columns.get(column, ()))
+        found.sort(key=lambda obj: obj.index)
+        return found
+
+class PlayerState:
+    def __init__(self, cell_size):
+        self.x = PLAYER_START_X
+        self.y = WINDOW_HEIGHT - cell_size
+        self.w = cell_size
+        self.h = cell_size
+        self.velocity = 0.0
+        self.rotation = 0.0
+        self.grounded = False
+        self.flipped = False
+        self.small = False
+        self.alive = True
+        self.finished = False
+        self.air_frames = 0
+        self.disabled = frozenset() # Flippers already triggered, see GameObject.mEnabled
+
+    def copy(self):
+        state = PlayerState.__new__(PlayerState)
+        state.__dict__.update(self.__dict__)
+        return state
+
+    def rect(self):
+        return (self.x, self.y, self.w, self.h)
+
+    def flags(self):
+        return ((GROUNDED if self.grounded else 0) | (FLIPPED if self.flipped else 0) |
+                (SMALL if self.small else 0) | (ALIVE if self.alive else 0))
+
+class Simulation:
+    # Steps the player with the same per-frame order as GameApplication.Update
+    def __init__(self, level, invincible=False):
+        # An invincible player records hits as DEATH events and keeps running
+        self.level = level
+        self.invincible = invincible
+        self.ground_level = WINDOW_HEIGHT
+
+    def current_gravity(self, state):
+        return SMALL_GRAVITY if state.small else self.level.gravity
+
+    def stop_jump(self, state, land_height):
+        state.y = land_height
+        state.grounded = True
+        state.velocity = 0.0
+        state.rotation = round_half_away((state.rotation + 5.0) / 90.0) * 90.0
+
+    def landing_height(self, state):
+        return 0 if state.flipped else self.ground_level - state.h
+
+    def step(self, state, jump):
+        # Advance one frame in place and return the events bitmask
+        if not state.alive or state.finished:
+            return 0
+        finish = self.level.finish
+        if finish is not None and state.x >= finish.rect[0] + finish.rect[2]:
+            state.finished = True
+            return FINISH
+
+        events = 0
+        was_airborne = state.air_frames > 2
+        state.grounded = False
+        nearby = self.level.nearby(state.rect())
+
+        # CheckForLanding
+        for obj in nearby:
+            if obj.obj_name != "Square" or intersect(state.rect(), obj.rect):
+                continue
+            preview = state.y + int(state.velocity + (-self.current_gravity(state) if state.flipped else self.current_gravity(state)))
+            overlap = intersect((state.x, preview, state.w, state.h), obj.rect)
+            if overlap:
+                self.stop_jump(state, preview + (overlap[1] if state.flipped else -overlap[1]))
+                if was_airborne:
+                    events |= LAND
+
+        # UpdateCollisions
+        for obj in nearby:
+            if not any(intersect(state.rect(), hitbox) for hitbox in obj.hitboxes):
+                continue
+            if obj.obj_name in ("Square", "Triangle"):
+                if self.invincible:
+                    events |= DEATH
+                    continue
+                state.alive = False
+                return events | DEATH
+            elif obj.obj_name == "Bouncer":
+                state.velocity = obj.bounce_height if state.flipped else -obj.bounce_height
+                events |= BOUNCE
+            elif obj.obj_name == "GravityFlipper" and obj.index not in state.disabled:
+                state.flipped = not state.flipped
+                state.grounded = False
+                state.disabled = state.disabled | {obj.index}
+                events |= GRAVITY_FLIP
+            elif obj.obj_name == "SizeFlipper" and obj.index not in state.disabled:
+                self.set_small(state, not state.small)
+                state.disabled = state.disabled | {obj.index}
+                events |= SIZE_FLIP
+
+        # ComponentPlayerMovement
+        state.x += self.level.player_speed
+
+        # ComponentPlayerInputJump
+        gravity = self.current_gravity(state)
+        if state.y == self.landing_height(state):
+            state.grounded = True
+        if state.grounded and jump:
+            state.grounded = False
+            state.velocity = JUMP_STRENGTH if state.flipped else -JUMP_STRENGTH
+            events |= JUMP
+        if state.flipped:
+            state.velocity = max(state.velocity - gravity, -MAX_VELOCITY)
+        else:
+            state.velocity = min(state.velocity + gravity, MAX_VELOCITY)
+        state.y += int(state.velocity)
+        if not state.grounded:
+            state.rotation += -ROTATION_SPEED if state.flipped else ROTATION_SPEED
+            if state.rotation >= 360.0:
+                state.rotation -= 360.0
+        if (state.y <= 0) if state.flipped else (state.y >= self.ground_level - state.h):
+            if state.air_frames > 2:
+                events |= LAND
+            self.stop_jump(state, self.landing_height(state))
+
+        state.air_frames = 0 if state.grounded else state.air_frames + 1
+        return events
+
+    def set_small(self, state, small):
+        # Same as ComponentTransform.SetSmall
+        state.small = small
+        if small:
+            state.w //= 2
+            state.h //= 2
+            state.y += state.h if state.flipped else -state.h
+        else:
+            state.w *= 2
+            state.h *= 2
+            state.y += state.h // 2 if state.flipped else -(state.h // 2)
+
+class Trace:
+    # Compact per-frame record of a replay
+    def __init__(self, x, y, rotation, flags, events, player_speed):
+        self.x = x
+        self.y = y
+        self.rotation = rotation
+        self.flags = flags
+        self.events = events
+        self.player_speed = player_speed
+
+    def __len__(self):
+        return len(self.x)
+
+    def camera_x(self, frame):
+        # The camera moves after the player on every frame
+        return (frame + 1) * self.player_speed
+
+    def event_list(self):
+        res = []
+        for frame in np.flatnonzero(self.events):
+            for bit, name in EVENT_NAMES.items():
+                if self.events[frame] & bit:
+                    res.append((int(frame), name))
+        return res
+
+    def outcome(self):
+        if len(self) and self.events[-1] & FINISH:
+            return "finish"
+        if len(self) and self.events[-1] & DEATH:
+            return "death"
+        return "timeout"
+
+    def save(self, path):
+        np.savez_compressed(path, x=self.x, y=self.y, rotation=self.rotation, flags=self.flags,
+                            events=self.events, player_speed=self.player_speed)
+
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        return Trace(data["x"], data["y"], data["rotation"], data["flags"], data["events"],
+                     int(data["player_speed"]))
+
+class Replay:
+    def __init__(self, level, jump_frames=None, window=300, invincible=False, max_frames=None, max_steps=None):
+        # With no jump_frames the jumps are found by a bounded search
+        self.level = level
+        self.simulation = Simulation(level)
+        self.invincible = invincible
+        self.jump_frames = jump_frames
+        self.window = window
+        if max_frames is None:
+            end = level.finish.rect[0] + level.finish.rect[2] if level.finish else level.config["level_width"] * level.cell_size
+            max_frames = (end - PLAYER_START_X) // level.player_speed + window
+        self.max_frames = max_frames
+        self.max_steps = 50 * max_frames if max_steps is None else max_steps
+
+    def can_jump(self, state):
+        return self.simulation.step(state.copy(), True) & JUMP
+
+    def search(self):
+        # Depth first search over jump frames: run without jumping and on death backtrack to the most
+        # recent frame where a jump was possible but not tried, as long as it lies within the window
+        # behind the furthest frame reached. Returns the jump frames of the furthest run.
+        state = PlayerState(self.level.cell_size)
+        trail, jumps, untried, best = [], [], [], []
+        force_jump = False
+        steps = 0
+        while len(jumps) < self.max_frames and steps < self.max_steps:
+            frame = len(jumps)
+            trail.append(state.copy())
+            jump = force_jump
+            if not force_jump and self.can_jump(state):
+                untried.append(frame)
+            force_jump = False
+
+            self.simulation.step(state, jump)
+            jumps.append(jump)
+            steps += 1
+            if state.finished:
+                best = jumps
+                break
+            if state.alive:
+                continue
+
+            if len(jumps) > len(best):
+                best = list(jumps)
+            if not untried or untried[-1] < len(best) - self.window:
+                break
+            frame = untried.pop()
+            state = trail[frame].copy()
+            del trail[frame:]
+            del jumps[frame:]
+            force_jump = True
+
+        return [frame for frame, jump in enumerate(best) if jump]
+
+    def run(self):
+        jump_frames = self.search() if self.jump_frames is None else self.jump_frames
+        jump_frames = set(jump_frames)
+        simulation = Simulation(self.level, self.invincible)
+        state = PlayerState(self.level.cell_size)
+        xs, ys, rotations, flags, events = [], [], [], [], []
+        for frame in range(self.max_frames):
+            frame_events = simulation.step(state, frame in jump_frames)
+            xs.append(state.x)
+            ys.append(state.y)
+            rotations.append(state.rotation)
+            flags.append(state.flags())
+            events.append(frame_events)
+            if not state.alive or state.finished:
+                break
+
+        return Trace(np.array(xs, dtype=np.int32), np.array(ys, dtype=np.int32),
+                     np.array(rotations, dtype=np.int16), np.array(flags, dtype=np.uint8),
+                     np.array(events, dtype=np.uint8), self.level.player_speed)
+
+class SpriteCache:
+    # Pre-scaled, pre-rotated sprites stored as premultiplied colour and inverse alpha arrays
+    def __init__(self, sprite_map, scale):
+        self.sprite_map = sprite_map
+        self.scale = scale
+        self.sheets = {}
+        self.sprites = {}
+
+    def load_sheet(self, obj_name):
+        if obj_name not in self.sheets:
+            with open(self.sprite_map[obj_name], "r") as file:
+                config = json.load(file)
+            sprite_sheet = Image.open(config["filepath"]).convert("RGBA")
+            tile_width, tile_height = config["format"]["tileWidth"], config["format"]["tileHeight"]
+            rows = config["format"]["height"] // tile_height
+            cols = config["format"]["width"] // tile_width
+            self.sheets[obj_name] = [sprite_sheet.crop((c * tile_width, r * tile_height, (c + 1) * tile_width, (r + 1) * tile_height))
+                                     for r in range(rows) for c in range(cols)]
+        return self.sheets[obj_name]
+
+    def get_sprite(self, obj_name, frame_num, angle, width, height):
+        frames = self.load_sheet(obj_name)
+        key = (obj_name, frame_num % len(frames), angle, width, height)
+        if key not in self.sprites:
+            size = (max(1, round(width * self.scale)), max(1, round(height * self.scale)))
+            image = frames[key[1]].resize(size, Image.BILINEAR)
+            if angle:
+                # SDL rotates clockwise about the centre without clipping
+                image = image.rotate(-angle, resample=Image.BILINEAR, expand=True)
+            pixels = np.asarray(image, dtype=np.float32) / 255.0
+            alpha = pixels[:, :, 3:4]
+            self.sprites[key] = (pixels[:, :, :3] * alpha, 1.0 - alpha, (size[0] - image.width) // 2, (size[1] - image.height) // 2)
+        return self.sprites[key]
+
+class ReplayRenderer:
+    def __init__(self, level, trace, scale=0.5):
+        self.level = level
+        self.trace = trace
+        self.scale = scale
+        self.width = round(WINDOW_WIDTH * scale)
+        self.height = round(WINDOW_HEIGHT * scale)
+        self.cache = SpriteCache(level.config["sprite_map"], scale)
+        self.background = np.empty((self.height, self.width, 3), dtype=np.float32)
+        self.background[:] = np.array(BACKGROUND, dtype=np.float32) / 255.0
+
+    def blit(self, canvas, obj_name, frame_num, angle, x, y, w, h):
+        if obj_name not in self.cache.sprite_map:
+            return
+        color, inv_alpha, dx, dy = self.cache.get_sprite(obj_name, frame_num, angle, w, h)
+        left = round(x * self.scale) + dx
+        top = round(y * self.scale) + dy
+        sprite_h, sprite_w = inv_alpha.shape[:2]
+
+        # Clip to the canvas, then alpha blend the overlapping region in one operation
+        x0, y0 = max(0, left), max(0, top)
+        x1, y1 = min(self.width, left + sprite_w), min(self.height, top + sprite_h)
+        if x0 >= x1 or y0 >= y1:
+            return
+        region = canvas[y0:y1, x0:x1]
+        sx, sy = x0 - left, y0 - top
+        region *= inv_alpha[sy:sy + y1 - y0, sx:sx + x1 - x0]
+        region += color[sy:sy + y1 - y0, sx:sx + x1 - x0]
+
+    def render_frame(self, frame):
+        camera_x = self.trace.camera_x(frame)
+        animation_frame = frame // ANIMATION_FRAMES
+        canvas = self.background.copy()
+
+        # Same draw order as the scene tree: finish, statics, collidables, then the player on top
+        first = camera_x // self.level.cell_size - 1
+        visible = self.level.in_columns(first, first + WINDOW_WIDTH // self.level.cell_size + 2)
+        for obj in ([self.level.finish] if self.level.finish else []) + self.level.statics + visible:
+            x, y, w, h = obj.rect
+            if obj.obj_name in PARALLAX_SPEEDS:
+                x += PARALLAX_SPEEDS[obj.obj_name] * (frame + 1)
+            if x + w < camera_x or x > camera_x + WINDOW_WIDTH:
+                continue
+            self.blit(canvas, obj.obj_name, animation_frame, obj.angle, x - camera_x, y, w, h)
+
+        size = self.level.cell_size // 2 if self.trace.flags[frame] & SMALL else self.level.cell_size
+        angle = int(self.trace.rotation[frame]) % 360
+        self.blit(canvas, "Player", animation_frame, angle, self.trace.x[frame] - camera_x, self.trace.y[frame], size, size)
+        return (canvas * 255.0 + 0.5).astype(np.uint8)
+
+    def render_frames(self, step=1):
+        for frame in range(0, len(self.trace), step):
+            yield self.render_frame(frame)
+
+    def animation_step(self):
+        # Every other frame, or sparser for replays that would not fit in MAX_ANIMATION_FRAMES
+        return max(2, -(-len(self.trace) // MAX_ANIMATION_FRAMES))
+
+    def save_animation(self, path, step=None):
+        # Frames are mapped to palette images as they are rendered. PIL still holds the palette images until the
+        # file is written, which the default step keeps to MAX_ANIMATION_FRAMES of them.
+        if step is None:
+            step = self.animation_step()
+        elif step < 1:
+            raise ValueError(f"animation step must be at least 1, got {step}")
+        palette, lookup = self.make_palette()
+        images = self.palette_images(step, palette, lookup)
+        next(images).save(path, save_all=True, append_images=images, duration=round(1000 * step / 60), loop=0, optimize=False)
+
+    def palette_images(self, step, palette, lookup):
+        for frame in self.render_frames(step):
+            image = Image.fromarray(lookup[self.color_index(frame)], "P")
+            image.putpalette(palette)
+            yield image
+
+    @staticmethod
+    def color_index(frame):
+        # 5 bits per channel, as an index into a 32768 entry lookup table
+        frame = frame.astype(np.uint16) >> 3
+        return (frame[:, :, 0] << 10) | (frame[:, :, 1] << 5) | frame[:, :, 2]
+
+    def make_palette(self):
+        # Quantize a few evenly spaced frames once, then map every frame through a shared lookup table
+        # instead of letting PIL quantize each GIF frame separately
+        frames = np.linspace(0, len(self.trace) - 1, num=min(PALETTE_SAMPLES, len(self.trace))).astype(int)
+        sample = np.concatenate([self.render_frame(frame) for frame in frames], axis=1)
+        palette = Image.fromarray(sample).quantize(colors=256).getpalette()[:768]
+        colors = np.array(palette, dtype=np.int32).reshape(-1, 3)
+
+        levels = (np.arange(32) << 3) + 4
+        grid = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"), axis=-1).reshape(-1, 3)
+        lookup = np.empty(len(grid), dtype=np.uint8)
+        for start in range(0, len(grid), 4096):
+            # Nearest palette colour: |g - c|^2 without the |g|^2 term, which is the same for every c
+            distance = (colors ** 2).sum(axis=1) - 2 * grid[start:start + 4096] @ colors.T
+            lookup[start:start + 4096] = distance.argmin(axis=1)
+        return palette, lookup
+
+    def save_strip(self, path, count=8):
+        # Evenly spaced preview frames laid out side by side
+        frames = np.linspace(0, len(self.trace) - 1, num=min(count, len(self.trace))).astype(int)
+        Image.fromarray(np.concatenate([self.render_frame(frame) for frame in frames], axis=1)).save(path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a level headlessly and render preview frames.")
+    parser.add_argument("level", help="path to a level JSON file")
+    parser.add_argument("--jumps", default=None, help="comma separated frames to jump on (default: search for them)")
+    parser.add_argument("--window", type=int, default=300, help="frames the jump search may backtrack")
+    parser.add_argument("--invincible", action="store_true", help="record deaths and keep running to the end")
+    parser.add_argument("--trace", default=None, help="write the per-frame trace to this .npz file")
+    parser.add_argument("--animation", default=None, help="write an animated GIF preview to this path")
+    parser.add_argument("--strip", default=None, help="write a strip of preview frames to this path")
+    parser.add_argument("--step", type=int, default=None,
+                        help=f"frames between animation frames (default: 2, or enough to fit {MAX_ANIMATION_FRAMES} frames)")
+    parser.add_argument("--count", type=int, default=8, help="frames in the preview strip")
+    parser.add_argument("--scale", type=float, default=0.5, help="render scale relative to the game window")
+    args = parser.parse_args()
+    if args.step is not None and args.step < 1:
+        parser.error("--step must be at least 1")
+
+    start = time.perf_counter()
+    level = ReplayLevel(args.level)
+    jump_frames = None if args.jumps is None else [int(frame) for frame in args.jumps.split(",") if frame]
+    trace = Replay(level, jump_frames, window=args.window, invincible=args.invincible).run()
+    deaths = int(np.count_nonzero(trace.events & DEATH))
+    print(f"Replayed {len(trace)} frames ({trace.outcome()}, {deaths} deaths) in {time.perf_counter() - start:.2f}s")
+
+    if args.trace:
+        trace.save(args.trace)
+    if args.animation or args.strip:
+        start = time.perf_counter()
+        renderer = ReplayRenderer(level, trace, args.scale)
+        if args.animation:
+            renderer.save_animation(args.animation, args.step)
+        if args.strip:
+            renderer.save_strip(args.strip, args.count)
+        print(f"Rendered previews in {time.perf_counter() - start:.2f}s")